@@ -0,0 +1,77 @@
+"""Time budget and cancellation of upstream work"""
+import threading
+import time
+
+import apis.deadline_exceptions as deadline_exceptions
+
+#pylint: disable=C0103
+
+class Deadline(object):
+    """
+    Time budget and cancellation token shared by the upstream calls of a
+    single request.
+
+    A probe can be given to detect cancellation from outside, e.g. a client
+    that has disconnected. It is called every time the deadline is checked.
+    The priority is used to schedule the upstream calls.
+    """
+
+    Exceptions = deadline_exceptions
+
+    def __init__(self, budget=None, probe=None, priority=None):
+        self.budget = budget
+        self.priority = priority
+        self.expires = time.time() + budget if budget is not None else None
+        self.probe = probe
+        self.cancel_event = threading.Event()
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "<Deadline (remaining: {}, cancelled: {})>".format(
+            self.remaining(), self.cancel_event.is_set())
+
+    def cancel(self):
+        """Cancel all pending work"""
+        self.cancel_event.set()
+
+    def is_cancelled(self):
+        """Whether work has been cancelled"""
+        if not self.cancel_event.is_set() and self.probe is not None and self.probe():
+            self.cancel()
+
+        return self.cancel_event.is_set()
+
+    def remaining(self):
+        """Seconds left, None if there is no time budget"""
+        if self.expires is None:
+            return None
+
+        return max(self.expires - time.time(), 0)
+
+    def check(self):
+        """Raise if work has been cancelled or the budget has run out"""
+        if self.is_cancelled():
+            raise Deadline.Exceptions.CancelledException()
+
+        if self.remaining() == 0:
+            raise Deadline.Exceptions.DeadlineExceededException()
+
+    def timeout(self):
+        """Check the deadline, then return a timeout for the next call"""
+        self.check()
+        return self.remaining()
+
+    def sleep(self, seconds):
+        """Sleep, waking up early if cancelled"""
+        remaining = self.timeout()
+        if remaining is not None and remaining < seconds:
+            raise Deadline.Exceptions.DeadlineExceededException()
+
+        self.cancel_event.wait(seconds)
+        self.check()
+
+def timeout(deadline):
+    """Timeout for the next call under deadline, None if there is no deadline"""
+    return deadline.timeout() if deadline is not None else None
@@ -0,0 +1,7 @@
+"""Deadline exceptions"""
+
+class DeadlineExceededException(Exception):
+    """Time budget ran out"""
+
+class CancelledException(Exception):
+    """Work was cancelled"""
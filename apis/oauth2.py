@@ -6,6 +6,8 @@ from urllib import urlencode
 import requests
 
 import apis.oauth2_exceptions as oauth2_exceptions
+from apis import deadline as deadlines
+from apis import profiling
 
 #pylint: disable=C0103
 
@@ -16,7 +18,7 @@ class OAuth2Session(object):
 
     def __init__(self, flask, service_name,
                  client_id, client_secret,
-                 authorize_url, auth_callback_url, request_token_url):
+                 authorize_url, auth_callback_url, request_token_url, scheduler=None):
         self.flask = flask
         self.service_name = service_name
         self.client_id = client_id
@@ -24,6 +26,7 @@ class OAuth2Session(object):
         self.authorize_url = authorize_url
         self.auth_callback_url = auth_callback_url
         self.request_token_url = request_token_url
+        self.scheduler = scheduler
 
         self.codes = {}
 
@@ -60,7 +63,7 @@ class OAuth2Session(object):
         except KeyError:
             raise OAuth2Session.Exceptions.AuthorizationFailedException()
 
-    def request_new_token(self):
+    def request_new_token(self, deadline=None):
         """Request a new token from service"""
         if "authorization_code" not in self.codes:
             raise OAuth2Session.Exceptions.NotAuthorizedException()
@@ -76,7 +79,7 @@ class OAuth2Session(object):
             "client_id": self.client_id,
             "client_secret": self.client_secret
         }
-        res = requests.post(self.request_token_url, data=payload)
+        res = self.send(deadline, requests.post, self.request_token_url, data=payload)
 
         if res.status_code != 200:
             raise OAuth2Session.Exceptions.AccessTokenRequestFailedException()
@@ -95,7 +98,7 @@ class OAuth2Session(object):
             # Invalid response
             raise OAuth2Session.Exceptions.AccessTokenRequestFailedException()
 
-    def get_token(self):
+    def get_token(self, deadline=None):
         """
         Get usable token.
         Will attempt to request a new token if current token is absent or expired.
@@ -106,30 +109,51 @@ class OAuth2Session(object):
                 del self.codes["token"]
                 raise KeyError()
         except KeyError:
-            self.request_new_token()
+            self.request_new_token(deadline)
             token = self.codes["token"]
 
         return token
 
-    def get_auth_header(self):
+    def get_auth_header(self, deadline=None):
         """"Returns header object with authorization code"""
-        token = self.get_token()
+        token = self.get_token(deadline)
         return {
             "Authorization": "{} {}".format(token["type"], token["access"])
         }
 
-    def make_get_request(self, method, params=None):
+    def send(self, deadline, send_request, method, **kargs):
+        """
+        Send request with send_request, giving up when deadline is cancelled
+        or runs out. The remaining budget is applied as a per-socket timeout.
+        Waits for a slot first if the session has a scheduler.
+        """
+        def send_now():
+            """Send without scheduling"""
+            try:
+                timeout = deadlines.timeout(deadline)
+                with profiling.span("upstream", method):
+                    return send_request(method, timeout=timeout, **kargs)
+            except requests.exceptions.Timeout:
+                raise deadlines.Deadline.Exceptions.DeadlineExceededException()
+
+        if self.scheduler is None:
+            return send_now()
+
+        with self.scheduler.slot(deadline):
+            return send_now()
+
+    def make_get_request(self, method, params=None, deadline=None):
         """Make raw get request"""
         params = params or {}
 
-        auth_header = self.get_auth_header()
-        res = requests.get(method, headers=auth_header, params=params)
+        auth_header = self.get_auth_header(deadline)
+        res = self.send(deadline, requests.get, method, headers=auth_header, params=params)
 
         return res
 
-    def get(self, method, params=None):
+    def get(self, method, params=None, deadline=None):
         """Get request"""
-        res = self.make_get_request(method, params)
+        res = self.make_get_request(method, params, deadline)
 
         if res.status_code != 200:
             raise OAuth2Session.Exceptions.RequestFailedException()
@@ -140,16 +164,16 @@ class OAuth2Session(object):
         except ValueError:
             raise OAuth2Session.Exceptions.RequestFailedException()
 
-    def post(self, method, body=None):
+    def post(self, method, body=None, deadline=None):
         """Post request"""
         body = body or {}
 
-        auth_header = self.get_auth_header()
+        auth_header = self.get_auth_header(deadline)
         auth_header.update({
             "Content-Type": "application/json"
         })
 
-        res = requests.post(method, headers=auth_header, json=body)
+        res = self.send(deadline, requests.post, method, headers=auth_header, json=body)
         if res.status_code not in [200, 201]:
             raise OAuth2Session.Exceptions.PostRequestFailedException()
 
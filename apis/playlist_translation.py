@@ -0,0 +1,72 @@
+"""Merging YouTube playlists and translating their videos into Spotify tracks"""
+from multiprocessing.pool import ThreadPool
+
+from apis.deadline import Deadline
+from apis.youtube_api import YouTubeClient
+from apis import profiling
+
+#pylint: disable=C0103
+
+def unique(playlist_ids):
+    """Drop repeated playlist ids, keeping the order of first occurrences"""
+    seen = set()
+    return [playlist_id for playlist_id in playlist_ids
+            if not (playlist_id in seen or seen.add(playlist_id))]
+
+def fetch_playlists(youtube_session, playlist_ids, deadline=None, threads=4):
+    """Fetch the items of every playlist, concurrently if there are several"""
+    def fetch(playlist_id):
+        """Fetch a single playlist"""
+        return youtube_session.get_playlist_items(playlist_id, deadline)
+
+    if len(playlist_ids) == 1:
+        return [fetch(playlist_ids[0])]
+
+    # Request token up front, concurrent fetches would each request their own
+    youtube_session.get_token(deadline)
+
+    pool = ThreadPool(min(len(playlist_ids), threads))
+    try:
+        return pool.map(profiling.propagate(fetch), playlist_ids)
+    finally:
+        pool.close()
+        pool.join()
+
+def merge_playlists(playlists):
+    """Names of the videos in playlists, keeping the first occurrence of each video"""
+    video_ids = set()
+    names = []
+    for playlist_items in playlists:
+        for item in playlist_items["items"]:
+            video_id = item["snippet"]["resourceId"]["videoId"]
+            if video_id not in video_ids:
+                video_ids.add(video_id)
+                names.append(item["snippet"]["title"])
+    return names
+
+def translate_playlists(youtube_session, playlist_ids, find_track, deadline=None, threads=4):
+    """
+    Translate videos in YouTube playlists into Spotify tracks, using
+    find_track(query, deadline) to look up every unique video once.
+
+    Returns the mappings and the number of unique videos. If the deadline runs
+    out or is cancelled while searching, only the mappings found so far are
+    returned.
+    """
+    names = merge_playlists(fetch_playlists(youtube_session, unique(playlist_ids),
+                                            deadline, threads))
+
+    items = []
+    try:
+        for youtube_name in names:
+            items.append({
+                "youtube": youtube_name,
+                "spotify": find_track(YouTubeClient.process_youtube_name(youtube_name), deadline)
+            })
+
+    except (Deadline.Exceptions.DeadlineExceededException,
+            Deadline.Exceptions.CancelledException):
+        # Keep what has been found so far
+        pass
+
+    return items, len(names)
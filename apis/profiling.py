@@ -0,0 +1,150 @@
+"""Opt-in request profiling"""
+from __future__ import division
+import cProfile
+import contextlib
+import json
+import os
+import random
+import threading
+import time
+
+#pylint: disable=C0103
+
+# Span recorder of the request being profiled on this thread, if any
+current = threading.local()
+
+class SpanRecorder(object):
+    """Records time spent in spans of a single request"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.spans = []
+
+    def add(self, category, label, started, duration):
+        """Record a finished span"""
+        self.spans.append((category, label, started - self.started, duration))
+
+    @staticmethod
+    def wall_time(spans):
+        """Time covered by spans, counting overlapping spans once"""
+        covered, end = 0., None
+        for (_, _, started, duration) in sorted(spans, key=lambda span: span[2]):
+            if end is None or started > end:
+                covered += duration
+                end = started + duration
+            elif started + duration > end:
+                covered += started + duration - end
+                end = started + duration
+        return covered
+
+    def breakdown(self):
+        """
+        Time per category, time outside spans is counted as "local".
+
+        Spans recorded in other threads may overlap, so "time" sums span
+        durations while "wall" counts overlapping time once.
+        """
+        total = time.time() - self.started
+        categories = {}
+        for (category, _, _, duration) in self.spans:
+            entry = categories.setdefault(category, {"count": 0, "time": 0.})
+            entry["count"] += 1
+            entry["time"] += duration
+
+        for (category, entry) in categories.items():
+            entry["wall"] = SpanRecorder.wall_time(
+                [span for span in self.spans if span[0] == category])
+
+        return {
+            "total": total,
+            "local": total - SpanRecorder.wall_time(self.spans),
+            "categories": categories,
+            "spans": self.spans
+        }
+
+@contextlib.contextmanager
+def span(category, label=""):
+    """Time the enclosed block if the current request is being profiled"""
+    recorder = getattr(current, "recorder", None)
+    if recorder is None:
+        yield
+        return
+
+    started = time.time()
+    try:
+        yield
+    finally:
+        recorder.add(category, label, started, time.time() - started)
+
+def propagate(function):
+    """
+    Wrap function so that spans it records in another thread are added to
+    the request being profiled on the calling thread
+    """
+    recorder = getattr(current, "recorder", None)
+
+    def wrapper(*args, **kargs):
+        """Wrapper"""
+        current.recorder = recorder
+        try:
+            return function(*args, **kargs)
+        finally:
+            current.recorder = None
+
+    return wrapper
+
+
+class RequestProfiler(object):
+    """
+    Profiles a sample of requests with cProfile and span recording.
+
+    For every profiled request a .prof file (readable with pstats) and a
+    .json file with the span breakdown are written into output_dir.
+    """
+
+    def __init__(self, enabled=False, sample_rate=0., header="X-Profile", output_dir="profiles"):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.header = header
+        self.output_dir = output_dir
+
+    def should_profile(self, headers, trusted=False):
+        """
+        Decide whether a request is profiled. The header is only honoured for
+        trusted clients, so that others cannot fill up output_dir.
+        """
+        if not self.enabled:
+            return False
+
+        return (trusted and self.header in headers) or random.random() < self.sample_rate
+
+    def start(self):
+        """Start profiling the current thread, returns the profile"""
+        current.recorder = SpanRecorder()
+
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile, name):
+        """Stop profiling the current thread and write results"""
+        profile.disable()
+
+        recorder = current.recorder
+        del current.recorder
+
+        try:
+            os.makedirs(self.output_dir)
+        except OSError:
+            # Already created, possibly by another thread
+            if not os.path.isdir(self.output_dir):
+                raise
+
+        file_name = os.path.join(self.output_dir, "{}-{:.6f}-{}".format(
+            name, recorder.started, threading.current_thread().ident))
+
+        profile.dump_stats(file_name + ".prof")
+        with open(file_name + ".json", "w") as breakdown:
+            json.dump(dict(recorder.breakdown(), name=name), breakdown, indent=4)
+
+        return file_name
@@ -5,23 +5,29 @@ import time
 import math
 
 from apis.oauth2 import OAuth2Session
+from apis import profiling
 
 #pylint: disable=C0103
 
 class SpotifyClient(OAuth2Session):
     """Spotify API with OAuth2 support"""
-    def __init__(self, flask, client_id, client_secret, auth_callback_url):
+    def __init__(self, flask, client_id, client_secret, auth_callback_url,
+                 accounts_url="https://accounts.spotify.com",
+                 api_url="https://api.spotify.com/v1",
+                 scheduler=None):
         super(SpotifyClient, self).__init__(
             flask, "Spotify",
             client_id, client_secret,
-            "https://accounts.spotify.com/authorize",
+            "{}/authorize".format(accounts_url),
             auth_callback_url,
-            "https://accounts.spotify.com/api/token"
+            "{}/api/token".format(accounts_url),
+            scheduler
         )
+        self.api_url = api_url
 
-    def get(self, method, params=None):
+    def get(self, method, params=None, deadline=None):
         """Override default oauth2 .get to handle HTTP 429 Too Many Requests"""
-        res = self.make_get_request(method, params)
+        res = self.make_get_request(method, params, deadline)
 
         if res.status_code == 200:
             # Success
@@ -40,10 +46,14 @@ class SpotifyClient(OAuth2Session):
                 wait_duration = int(res.headers["Retry-After"])
 
                 print("HTTP 427 received, sleeping for {} seconds".format(wait_duration))
-                time.sleep(wait_duration)
+                with profiling.span("upstream", "Retry-After"):
+                    if deadline is not None:
+                        deadline.sleep(wait_duration)
+                    else:
+                        time.sleep(wait_duration)
 
                 # Try again
-                return self.get(method, params)
+                return self.get(method, params, deadline)
 
             except KeyError:
                 # Missing amount of seconds to wait
@@ -53,24 +63,24 @@ class SpotifyClient(OAuth2Session):
             # All other status codes
             raise OAuth2Session.Exceptions.RequestFailedException()
 
-    def get_user_profile(self):
+    def get_user_profile(self, deadline=None):
         """Get user profile"""
-        return self.get("https://api.spotify.com/v1/me")
+        return self.get("{}/me".format(self.api_url), deadline=deadline)
 
-    def get_user_playlists(self):
+    def get_user_playlists(self, deadline=None):
         """Get user playlists"""
-        return self.get("https://api.spotify.com/v1/me/playlists")
+        return self.get("{}/me/playlists".format(self.api_url), deadline=deadline)
 
-    def search_track(self, query):
+    def search_track(self, query, deadline=None):
         """Search for a single track by query"""
         print(u"Querying Spotify: {}".format(query))
 
         # Perform search
-        search_result = self.get("https://api.spotify.com/v1/search", {
+        search_result = self.get("{}/search".format(self.api_url), {
             "q": unicode(query).encode("utf-8"),
             "type": "track",
             "limit": 1
-        })
+        }, deadline)
 
         try: 
             items = search_result["tracks"]["items"]
@@ -88,15 +98,41 @@ class SpotifyClient(OAuth2Session):
             # Invalid response
             raise OAuth2Session.Exceptions.RequestFailedException()
 
-    def add_tracks_to_playlist(self, user_id, playlist_id, track_uris):
+    def get_several_tracks(self, track_ids, deadline=None):
+        """
+        Get tracks by ids, in the same order as track_ids.
+        Unknown ids are returned as None.
+        """
+        if len(track_ids) <= 50:
+            if not track_ids:
+                return []
+
+            result = self.get("{}/tracks".format(self.api_url), {
+                "ids": ",".join(track_ids)
+            }, deadline)
+
+            try:
+                return result["tracks"]
+            except KeyError:
+                # Invalid response
+                raise OAuth2Session.Exceptions.RequestFailedException()
+        else:
+            # Split and request them in separated requests
+            tracks = []
+            for i in range(0, int(math.ceil(len(track_ids) / 50.))):
+                tracks.extend(self.get_several_tracks(track_ids[50*i : 50*(i+1)], deadline))
+            return tracks
+
+    def add_tracks_to_playlist(self, user_id, playlist_id, track_uris, deadline=None):
         """Add tracks to playlist"""
-        method = "https://api.spotify.com/v1/users/{user_id}/playlists/{playlist_id}/tracks".format(
-            user_id=user_id, playlist_id=playlist_id)
+        method = "{api_url}/users/{user_id}/playlists/{playlist_id}/tracks".format(
+            api_url=self.api_url, user_id=user_id, playlist_id=playlist_id)
 
         if len(track_uris) <= 100:
             # Post to API
-            self.post(method, body={"uris": track_uris})
+            self.post(method, body={"uris": track_uris}, deadline=deadline)
         else:
             # Split and add them in separated requests
             for i in range(0, int(math.ceil(len(track_uris) / 100.))):
-                self.add_tracks_to_playlist(user_id, playlist_id, track_uris[100*i : 100*(i+1)])
+                self.add_tracks_to_playlist(user_id, playlist_id, track_uris[100*i : 100*(i+1)],
+                                            deadline)
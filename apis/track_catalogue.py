@@ -0,0 +1,153 @@
+"""Offline catalogue of known Spotify tracks"""
+from __future__ import division
+import mmap
+import os
+import re
+
+import apis.track_catalogue_exceptions as track_catalogue_exceptions
+
+#pylint: disable=C0103
+
+class TrackCatalogue(object):
+    """
+    Local catalogue of known Spotify tracks.
+
+    The catalogue file is memory-mapped and holds one track per line:
+
+        <uri>\\t<name>\\t<artist>; <artist>\\t<duration_ms>
+
+    An inverted index of tokens to record offsets and the name and artist
+    tokens of every record are kept in memory, the records themselves are
+    read from the mapping when needed.
+
+    A track only matches a query containing every token of its name and at
+    least one token of its artists, so other songs of the same artist are
+    never matched.
+    """
+
+    Exceptions = track_catalogue_exceptions
+
+    TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+    def __init__(self, file_name, min_score=0.7):
+        self.file_name = file_name
+        self.min_score = min_score
+
+        self.index = {}
+        # Offset to (name tokens, artist tokens)
+        self.track_tokens = {}
+
+        self.file = open(file_name, "rb")
+        if os.fstat(self.file.fileno()).st_size > 0:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # Empty files cannot be mapped
+            self.data = None
+
+        self.build_index()
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "<TrackCatalogue {} (tracks: {})>".format(self.file_name, len(self))
+
+    def __len__(self):
+        return len(self.track_tokens)
+
+    def close(self):
+        """Release the catalogue file"""
+        if self.data is not None:
+            self.data.close()
+        self.file.close()
+
+    @staticmethod
+    def tokenize(text):
+        """Split text into a set of lowercase word tokens"""
+        return frozenset(TrackCatalogue.TOKEN_PATTERN.findall(text.lower()))
+
+    @staticmethod
+    def parse_record(line):
+        """Parse a single catalogue line"""
+        try:
+            fields = line.decode("utf-8").rstrip(u"\r\n").split(u"\t")
+            if len(fields) != 4:
+                raise TrackCatalogue.Exceptions.InvalidCatalogueException()
+
+            uri, name, artists, duration_ms = fields
+            return {
+                "uri": uri,
+                "name": name,
+                "artists": [artist.strip() for artist in artists.split(u";") if artist.strip()],
+                "duration_ms": int(duration_ms)
+            }
+        except ValueError:
+            # Also raised for lines that are not valid UTF-8
+            raise TrackCatalogue.Exceptions.InvalidCatalogueException()
+
+    def build_index(self):
+        """Scan the mapped file and index every record by its tokens"""
+        if self.data is None:
+            return
+
+        self.data.seek(0)
+        while True:
+            offset = self.data.tell()
+            line = self.data.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+
+            track = TrackCatalogue.parse_record(line)
+            name_tokens = TrackCatalogue.tokenize(track["name"])
+            artist_tokens = TrackCatalogue.tokenize(u" ".join(track["artists"]))
+
+            self.track_tokens[offset] = (name_tokens, artist_tokens)
+            for token in name_tokens | artist_tokens:
+                self.index.setdefault(token, []).append(offset)
+
+    def get_track(self, offset):
+        """Read the record starting at offset"""
+        # Slice instead of seek/readline so that lookups are thread safe
+        end = self.data.find(b"\n", offset)
+        if end == -1:
+            end = len(self.data)
+        return TrackCatalogue.parse_record(self.data[offset:end])
+
+    def lookup(self, query):
+        """
+        Find the best matching track for query.
+
+        Returns a search_track style result, or None when no track matches
+        with a score of at least min_score.
+        """
+        query_tokens = TrackCatalogue.tokenize(query)
+        if not query_tokens:
+            return None
+
+        # Count shared tokens per candidate
+        shared = {}
+        for token in query_tokens:
+            for offset in self.index.get(token, ()):
+                shared[offset] = shared.get(offset, 0) + 1
+
+        best_offset, best_score = None, 0
+        for offset, count in shared.items():
+            name_tokens, artist_tokens = self.track_tokens[offset]
+            if not name_tokens <= query_tokens or not artist_tokens & query_tokens:
+                continue
+
+            # Dice coefficient between query and track tokens
+            score = 2 * count / (len(query_tokens) + len(name_tokens | artist_tokens))
+            if score > best_score:
+                best_offset, best_score = offset, score
+
+        if best_offset is None or best_score < self.min_score:
+            return None
+
+        track = self.get_track(best_offset)
+        return {
+            "name": track["name"],
+            "uri": track["uri"]
+        }
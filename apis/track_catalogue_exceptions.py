@@ -0,0 +1,4 @@
+"""Track catalogue exceptions"""
+
+class InvalidCatalogueException(Exception):
+    """Catalogue file contains a malformed record"""
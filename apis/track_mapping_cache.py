@@ -0,0 +1,130 @@
+"""Cache of resolved YouTube name to Spotify track mappings"""
+from collections import OrderedDict
+import gzip
+import json
+import re
+import threading
+
+#pylint: disable=C0103
+
+class TrackMappingCache(object):
+    """
+    Thread safe cache of search results.
+
+    Mappings can be dumped to and loaded from a gzipped JSON file so that
+    they survive restarts. Searches that found no track are not cached, so
+    they are retried.
+
+    At most max_size mappings are kept, the least recently set ones are
+    dropped first.
+    """
+
+    URI_PATTERN = re.compile(r"spotify:track:[0-9A-Za-z]{22}\Z")
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.mappings = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "<TrackMappingCache (mappings: {})>".format(len(self))
+
+    def __len__(self):
+        return len(self.mappings)
+
+    @staticmethod
+    def normalize(query):
+        """Normalize query into cache key"""
+        return u" ".join(query.lower().split())
+
+    def get(self, query):
+        """Get cached track for query, None if not cached"""
+        with self.lock:
+            track = self.mappings.get(TrackMappingCache.normalize(query))
+
+        return dict(track) if track is not None else None
+
+    def set(self, query, track):
+        """Cache track for query, ignored if no track was found"""
+        if track["uri"] is None:
+            return
+
+        with self.lock:
+            self.add(TrackMappingCache.normalize(query), track["name"], track["uri"])
+
+    def add(self, key, name, uri):
+        """Store a mapping as the most recent one, lock must be held"""
+        self.mappings.pop(key, None)
+        self.mappings[key] = {"name": name, "uri": uri}
+        while len(self.mappings) > self.max_size:
+            self.mappings.popitem(last=False)
+
+    def dump(self, fileobj):
+        """Write all mappings to fileobj, returns number of mappings written"""
+        with self.lock:
+            rows = [[query, track["name"], track["uri"]]
+                    for (query, track) in self.mappings.items()]
+
+        with gzip.GzipFile(fileobj=fileobj, mode="wb") as out:
+            out.write(json.dumps(rows, separators=(",", ":")).encode("ascii"))
+
+        return len(rows)
+
+    def load(self, fileobj):
+        """
+        Merge mappings from fileobj, returns number of mappings read.
+        Raises ValueError if the file is not a valid dump.
+        """
+        try:
+            with gzip.GzipFile(fileobj=fileobj, mode="rb") as source:
+                rows = json.loads(source.read().decode("ascii"))
+        except IOError as e:
+            raise ValueError(e)
+
+        if not isinstance(rows, list):
+            raise ValueError("Dump is not a list of mappings")
+
+        mappings = []
+        for row in rows:
+            if not isinstance(row, list) or len(row) != 3:
+                raise ValueError("Invalid mapping {!r}".format(row))
+
+            query, name, uri = row
+            if uri is None:
+                # Skip searches that found no track
+                continue
+            if not all(isinstance(value, basestring) for value in row) or \
+                    not TrackMappingCache.URI_PATTERN.match(uri):
+                raise ValueError("Invalid mapping {!r}".format(row))
+
+            mappings.append((TrackMappingCache.normalize(query), name, uri))
+
+        with self.lock:
+            for mapping in mappings:
+                self.add(*mapping)
+
+        return len(mappings)
+
+    def revalidate(self, spotify_session, deadline=None):
+        """
+        Check every cached URI is still available on Spotify, dropping the
+        ones that are not. Returns number of mappings dropped.
+        """
+        with self.lock:
+            uris = set(track["uri"] for track in self.mappings.values()
+                       if track["uri"] is not None)
+
+        uris = sorted(uris)
+        tracks = spotify_session.get_several_tracks([uri.split(":")[-1] for uri in uris], deadline)
+        stale = set(uri for (uri, track) in zip(uris, tracks) if track is None)
+
+        with self.lock:
+            stale_queries = [query for (query, track) in self.mappings.items()
+                             if track["uri"] in stale]
+            for query in stale_queries:
+                del self.mappings[query]
+
+        return len(stale_queries)
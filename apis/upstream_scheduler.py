@@ -0,0 +1,189 @@
+"""Priority scheduling of upstream requests"""
+from __future__ import division
+import contextlib
+import threading
+import time
+
+from apis import profiling
+
+#pylint: disable=C0103
+
+"""
+Priorities, highest first
+"""
+INTERACTIVE = "interactive"
+TRANSLATION = "translation"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, TRANSLATION, BULK)
+
+# Upstream work not tied to a request, e.g. prewarming
+DEFAULT_PRIORITY = BULK
+
+"""
+What waiting requests are blocked on
+"""
+CONCURRENCY = "concurrency"
+TOKENS = "tokens"
+
+
+class UpstreamScheduler(object):
+    """
+    Limits concurrency and rate of upstream requests across all sessions.
+
+    Each priority reserves a share of the concurrency and of the rate. The
+    unreserved remainder is shared, and given to the highest priority with
+    requests waiting for it.
+    """
+
+    DEFAULT_SHARES = {
+        INTERACTIVE: .25,
+        TRANSLATION: .25,
+        BULK: .125
+    }
+
+    # Longest wait before re-checking deadlines, which may be cancelled by probes
+    POLL_INTERVAL = .5
+
+    # Shortest wait, so that rounding never turns waiting into spinning
+    MIN_WAIT = .01
+
+    def __init__(self, concurrency=8, rate=None, shares=None):
+        shares = dict(UpstreamScheduler.DEFAULT_SHARES, **(shares or {}))
+        if sum(shares.values()) > 1:
+            raise ValueError("Shares add up to more than 1")
+
+        self.concurrency = concurrency
+        self.rate = rate
+
+        self.reserved = {p: int(shares[p] * concurrency) for p in PRIORITIES}
+        self.shared = concurrency - sum(self.reserved.values())
+
+        # Token buckets, refilled at rate requests per second
+        self.bucket_rates = None
+        if rate is not None:
+            self.bucket_rates = {p: shares[p] * rate for p in PRIORITIES}
+            self.bucket_rates[None] = (1 - sum(shares.values())) * rate
+            self.tokens = {p: UpstreamScheduler.capacity(r) for (p, r) in self.bucket_rates.items()}
+            self.refilled = time.time()
+
+        self.running = {p: 0 for p in PRIORITIES}
+        # Waiting requests per priority, by what they are blocked on
+        self.waiting = {p: {CONCURRENCY: 0, TOKENS: 0} for p in PRIORITIES}
+        self.requests = {p: 0 for p in PRIORITIES}
+        self.wait_total = {p: 0. for p in PRIORITIES}
+        self.wait_max = {p: 0. for p in PRIORITIES}
+
+        self.condition = threading.Condition()
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return "<UpstreamScheduler (concurrency: {}, rate: {}, running: {})>".format(
+            self.concurrency, self.rate, sum(self.running.values()))
+
+    @staticmethod
+    def capacity(rate):
+        """Bucket size, allowing a burst of one second worth of requests"""
+        return max(rate, 1) if rate else 0
+
+    def refill(self):
+        """Add tokens earned since the last refill"""
+        now = time.time()
+        elapsed, self.refilled = now - self.refilled, now
+        for (bucket, rate) in self.bucket_rates.items():
+            self.tokens[bucket] = min(self.tokens[bucket] + elapsed * rate,
+                                      UpstreamScheduler.capacity(rate))
+
+    def outranked(self, priority, blocked):
+        """Whether a higher priority is waiting for the same kind of capacity"""
+        return any(self.waiting[other][blocked]
+                   for other in PRIORITIES[:PRIORITIES.index(priority)])
+
+    def token_wait(self, priority):
+        """Seconds until a token may be available to priority, None if unknown"""
+        waits = [(1 - self.tokens[bucket]) / self.bucket_rates[bucket]
+                 for bucket in (priority, None)
+                 if self.bucket_rates[bucket] and self.tokens[bucket] < 1]
+        if not waits:
+            # Tokens are there but outranked, or the buckets never refill
+            return None
+
+        return max(min(waits), UpstreamScheduler.MIN_WAIT)
+
+    def try_acquire(self, priority):
+        """
+        Take a slot (and a token) if possible.
+
+        Returns (True, None, None) on success, otherwise (False, what it is
+        blocked on, seconds worth waiting) with None seconds if unknown.
+        """
+        # Concurrency
+        if self.running[priority] >= self.reserved[priority]:
+            shared_running = sum(max(self.running[p] - self.reserved[p], 0) for p in PRIORITIES)
+            if shared_running >= self.shared or self.outranked(priority, CONCURRENCY):
+                return False, CONCURRENCY, None
+
+        # Rate
+        if self.bucket_rates is not None:
+            self.refill()
+            if self.tokens[priority] >= 1:
+                self.tokens[priority] -= 1
+            elif self.tokens[None] >= 1 and not self.outranked(priority, TOKENS):
+                self.tokens[None] -= 1
+            else:
+                return False, TOKENS, self.token_wait(priority)
+
+        self.running[priority] += 1
+        return True, None, None
+
+    @contextlib.contextmanager
+    def slot(self, deadline=None):
+        """Hold a slot for one upstream request at the deadline's priority"""
+        priority = getattr(deadline, "priority", None) or DEFAULT_PRIORITY
+        started = time.time()
+
+        with profiling.span("queue", priority):
+            with self.condition:
+                while True:
+                    acquired, blocked, wait = self.try_acquire(priority)
+                    if acquired:
+                        break
+
+                    self.waiting[priority][blocked] += 1
+                    try:
+                        if deadline is not None:
+                            deadline.check()
+                        self.condition.wait(min(wait or UpstreamScheduler.POLL_INTERVAL,
+                                                UpstreamScheduler.POLL_INTERVAL))
+                    finally:
+                        self.waiting[priority][blocked] -= 1
+
+                waited = time.time() - started
+                self.requests[priority] += 1
+                self.wait_total[priority] += waited
+                self.wait_max[priority] = max(self.wait_max[priority], waited)
+
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.running[priority] -= 1
+                self.condition.notify_all()
+
+    def stats(self):
+        """Queue depth, running requests and wait times per priority"""
+        with self.condition:
+            return {
+                "concurrency": self.concurrency,
+                "shared": self.shared,
+                "rate": self.rate,
+                "priorities": {p: {
+                    "reserved": self.reserved[p],
+                    "queued": sum(self.waiting[p].values()),
+                    "running": self.running[p],
+                    "requests": self.requests[p],
+                    "wait_avg": self.wait_total[p] / self.requests[p] if self.requests[p] else 0.,
+                    "wait_max": self.wait_max[p]
+                } for p in PRIORITIES}
+            }
@@ -6,26 +6,31 @@ from apis.oauth2 import OAuth2Session
 
 class YouTubeClient(OAuth2Session):
     """YouTube API with OAuth2 support"""
-    def __init__(self, flask, client_id, client_secret, auth_callback_url):
+    def __init__(self, flask, client_id, client_secret, auth_callback_url,
+                 accounts_url="https://accounts.google.com",
+                 api_url="https://www.googleapis.com/youtube/v3",
+                 scheduler=None):
         super(YouTubeClient, self).__init__(
             flask, "YouTube",
             client_id, client_secret,
-            "https://accounts.google.com/o/oauth2/v2/auth",
+            "{}/o/oauth2/v2/auth".format(accounts_url),
             auth_callback_url,
-            "https://accounts.google.com/o/oauth2/token"
+            "{}/o/oauth2/token".format(accounts_url),
+            scheduler
         )
+        self.api_url = api_url
 
-    def get_playlist_items(self, playlist_id):
+    def get_playlist_items(self, playlist_id, deadline=None):
         """
         Get playlist items by id
 
         Sample playlist id: RD2Vv-BfVoq4g
         """
-        return self.get("https://www.googleapis.com/youtube/v3/playlistItems", {
+        return self.get("{}/playlistItems".format(self.api_url), {
             "part": "snippet",
             "playlistId": playlist_id,
             "maxResults": 50
-        })
+        }, deadline)
 
     @staticmethod
     def process_youtube_name(name):
@@ -0,0 +1,368 @@
+"""
+Load test server.py with concurrent cookie sessions against stub upstreams
+
+Usage:
+
+    python load_test.py --sessions 20 --iterations 5
+
+A stub Spotify/Google/YouTube server is started locally, server.py is started
+in a temporary directory with a client_info.json pointing at the stub, and
+every simulated session goes through the whole translation flow.
+"""
+from __future__ import division, print_function
+import argparse
+import hashlib
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+import requests
+
+# pylint: disable=C0103
+
+
+"""
+Stub upstreams
+"""
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    """Answers the subset of Spotify, Google and YouTube APIs used by the server"""
+
+    # Set from command line options
+    latency = 0
+    playlist_size = 50
+
+    def log_message(self, *args):
+        """Keep the stub quiet"""
+
+    def send_json(self, data, status_code=200):
+        """Send data as JSON"""
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Handle GET requests"""
+        time.sleep(self.latency)
+        url = urlparse(self.path)
+        query = {k: v[0] for (k, v) in parse_qs(url.query).items()}
+
+        if url.path.endswith("/playlistItems"):
+            playlist_id = query.get("playlistId", "")
+            self.send_json({"items": [{
+                "snippet": {
+                    "title": "Artist {0} - Song {0} (Official Video)".format(
+                        stub_id(playlist_id, i)),
+                    "resourceId": {"videoId": stub_id(playlist_id, i)}
+                }
+            } for i in range(self.playlist_size)]})
+
+        elif url.path.endswith("/search"):
+            track_id = stub_id(query.get("q", ""))
+            self.send_json({"tracks": {"items": [{
+                "name": query.get("q", ""),
+                "uri": "spotify:track:{}".format(track_id)
+            }]}})
+
+        elif url.path.endswith("/me/playlists"):
+            self.send_json({"items": [{
+                "id": "playlist{}".format(i),
+                "name": "Playlist {}".format(i),
+                "external_urls": {"spotify": "http://localhost/playlist{}".format(i)}
+            } for i in range(10)]})
+
+        elif url.path.endswith("/me"):
+            self.send_json({
+                "id": "user",
+                "display_name": "Load Test",
+                "external_urls": {"spotify": "http://localhost/user"}
+            })
+
+        elif url.path.endswith("/tracks"):
+            self.send_json({"tracks": [{"id": track_id} for track_id in
+                                       query.get("ids", "").split(",")]})
+
+        else:
+            self.send_json({}, 404)
+
+    def do_POST(self):
+        """Handle POST requests"""
+        time.sleep(self.latency)
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+
+        if self.path.endswith("/token"):
+            self.send_json({
+                "token_type": "Bearer",
+                "access_token": "token",
+                "expires_in": 3600
+            })
+
+        elif self.path.endswith("/tracks"):
+            self.send_json({"snapshot_id": "snapshot"}, 201)
+
+        else:
+            self.send_json({}, 404)
+
+
+class StubUpstream(ThreadingMixIn, HTTPServer):
+    """Threaded stub upstream server"""
+    daemon_threads = True
+
+def stub_id(*parts):
+    """Deterministic id for stub data"""
+    return hashlib.sha1(":".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:22]
+
+
+"""
+Process memory
+"""
+def process_tree(pid):
+    """pid and the ids of all its descendants, read from /proc"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(entry)) as stat:
+                # Skip past the command name, which may contain spaces
+                ppid = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+def process_rss(pid):
+    """Resident set size of pid and its descendants in kB"""
+    total = 0
+    for current in process_tree(pid):
+        try:
+            with open("/proc/{}/status".format(current)) as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except (IOError, OSError):
+            pass
+    return total
+
+
+"""
+Load generator
+"""
+class Recorder(object):
+    """Thread safe collection of request results"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = {}
+        self.rss = []
+
+    def record(self, route, duration, ok):
+        """Record one request, route is the method and path, e.g. GET /create_session"""
+        with self.lock:
+            self.results.setdefault(route, []).append((duration, ok))
+
+    def sample_rss(self, pid, interval, stopped):
+        """Sample server memory until stopped is set"""
+        started = time.time()
+        while not stopped.is_set():
+            self.rss.append((time.time() - started, process_rss(pid)))
+            stopped.wait(interval)
+
+def percentile(values, fraction):
+    """Nearest rank percentile of sorted values"""
+    if not values:
+        return 0
+    return values[max(0, int(math.ceil(fraction * len(values))) - 1)]
+
+def run_session(base_url, session_number, options, recorder):
+    """Go through the whole translation flow options.iterations times"""
+    client = requests.Session()
+
+    def call(route, method="GET", **kargs):
+        """Make a request and record it"""
+        started = time.time()
+        try:
+            res = client.request(method, base_url + route, allow_redirects=False,
+                                 timeout=options.timeout, **kargs)
+            ok = res.status_code < 400
+        except requests.RequestException:
+            ok = False
+        recorder.record("{} {}".format(method, route), time.time() - started, ok)
+        return ok
+
+    for iteration in range(options.iterations):
+        if options.playlists:
+            playlist_id = "playlist{}".format((session_number + iteration) % options.playlists)
+        else:
+            playlist_id = "playlist-{}-{}".format(session_number, iteration)
+
+        call("/create_session")
+        call("/auth_spotify")
+        call("/spotify-authorization-callback", params={"code": "code"})
+        call("/auth_youtube")
+        call("/youtube-authorization-callback", params={"code": "code"})
+        call("/read_youtube_playlist", params={"youtube_playlist_id": playlist_id})
+        call("/select_export_playlist")
+        call("/select_export_playlist", "POST", data={"playlist_id": "playlist0"})
+        call("/remove_session")
+
+def report(recorder, elapsed):
+    """Print latency, throughput, error and memory report"""
+    print("{:<40} {:>7} {:>7} {:>8} {:>9} {:>9} {:>9} {:>9}".format(
+        "route", "count", "errors", "error %", "p50 ms", "p95 ms", "p99 ms", "req/s"))
+
+    total, total_errors = 0, 0
+    for route in sorted(recorder.results):
+        results = recorder.results[route]
+        durations = sorted(duration * 1000 for (duration, _) in results)
+        errors = len([ok for (_, ok) in results if not ok])
+        total += len(results)
+        total_errors += errors
+
+        print("{:<40} {:>7} {:>7} {:>8.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            route, len(results), errors, 100 * errors / len(results),
+            percentile(durations, .50), percentile(durations, .95), percentile(durations, .99),
+            len(results) / elapsed))
+
+    print("\n{} requests in {:.1f}s, {:.1f} req/s, {:.1f}% errors".format(
+        total, elapsed, total / elapsed, 100 * total_errors / total if total else 0.))
+
+    if recorder.rss:
+        print("\nServer RSS (kB):")
+        for (offset, rss) in recorder.rss:
+            print("{:>8.1f}s {:>10}".format(offset, rss))
+
+def wait_until_up(url, timeout):
+    """Poll url until the server answers"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(.2)
+    return False
+
+def start_server(workdir, stub_url):
+    """Start server.py in workdir with upstreams pointed at the stub"""
+    with open(os.path.join(workdir, "client_info.json"), "w") as info:
+        json.dump({
+            "spotify": {
+                "client_id": "spotify", "client_secret": "secret",
+                "endpoints": {
+                    "accounts_url": stub_url + "/spotify-accounts",
+                    "api_url": stub_url + "/spotify/v1"
+                }
+            },
+            "youtube": {
+                "client_id": "youtube", "client_secret": "secret",
+                "endpoints": {
+                    "accounts_url": stub_url + "/google",
+                    "api_url": stub_url + "/youtube/v3"
+                }
+            }
+        }, info)
+
+    log = open(os.path.join(workdir, "server.log"), "w")
+    server_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+
+    # Own process group, so the debug reloader's child is stopped too
+    return subprocess.Popen([sys.executable, server_file], cwd=workdir,
+                            stdout=log, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+
+def main():
+    """Entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--sessions", type=int, default=10,
+                        help="number of concurrent cookie sessions")
+    parser.add_argument("--iterations", type=int, default=3,
+                        help="translation flows per session")
+    parser.add_argument("--playlists", type=int, default=0,
+                        help="number of distinct playlist ids to cycle through, 0 for all unique")
+    parser.add_argument("--playlist-size", type=int, default=50,
+                        help="videos per stub playlist")
+    parser.add_argument("--upstream-latency", type=float, default=.01,
+                        help="seconds the stub waits before answering")
+    parser.add_argument("--stub-port", type=int, default=5001)
+    parser.add_argument("--server-url", default=None,
+                        help="use an already running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, default=None,
+                        help="pid to sample RSS from when using --server-url")
+    parser.add_argument("--rss-interval", type=float, default=1.)
+    parser.add_argument("--timeout", type=float, default=60.)
+    options = parser.parse_args()
+
+    StubUpstreamHandler.latency = options.upstream_latency
+    StubUpstreamHandler.playlist_size = options.playlist_size
+    stub = StubUpstream(("127.0.0.1", options.stub_port), StubUpstreamHandler)
+    stub_thread = threading.Thread(target=stub.serve_forever)
+    stub_thread.daemon = True
+    stub_thread.start()
+
+    workdir, server = None, None
+    base_url, server_pid = options.server_url, options.server_pid
+    if base_url is None:
+        workdir = tempfile.mkdtemp(prefix="load_test")
+        server = start_server(workdir, "http://127.0.0.1:{}".format(options.stub_port))
+        base_url, server_pid = "http://localhost:5000", server.pid
+        print("Server log: {}".format(os.path.join(workdir, "server.log")))
+
+    try:
+        if not wait_until_up(base_url + "/", 30):
+            print("Server did not come up, aborting.")
+            return 1
+
+        recorder = Recorder()
+        stopped = threading.Event()
+        if server_pid is not None:
+            sampler = threading.Thread(target=recorder.sample_rss,
+                                       args=(server_pid, options.rss_interval, stopped))
+            sampler.daemon = True
+            sampler.start()
+
+        started = time.time()
+        sessions = [threading.Thread(target=run_session, args=(base_url, i, options, recorder))
+                    for i in range(options.sessions)]
+        for session in sessions:
+            session.start()
+        for session in sessions:
+            session.join()
+        elapsed = time.time() - started
+        stopped.set()
+
+        report(recorder, elapsed)
+        return 0
+
+    finally:
+        stub.shutdown()
+        if server is not None:
+            os.killpg(server.pid, signal.SIGTERM)
+            server.wait()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,11 @@ from uuid import uuid4
 import hashlib
 import json
 import os
+import select
+import socket
 import sys
+import tempfile
+import threading
 import traceback
 
 import flask
@@ -13,8 +17,15 @@ from flask_api import status
 from apis.session_data import SessionDataContainer
 
 from apis.oauth2 import OAuth2Session
+from apis.deadline import Deadline
+from apis.upstream_scheduler import UpstreamScheduler
+from apis import upstream_scheduler as priorities
 from apis.spotify_api import SpotifyClient
 from apis.youtube_api import YouTubeClient
+from apis.track_catalogue import TrackCatalogue
+from apis.track_mapping_cache import TrackMappingCache
+from apis import playlist_translation
+from apis import profiling
 
 
 # pylint: disable=C0103
@@ -39,6 +50,44 @@ with open(CLIENT_INFO_FILE) as info:
         sys.exit(1)
 
 
+"""
+Optional local catalogue of known Spotify tracks, consulted before searching
+"""
+CATALOGUE_FILE = "catalogue.tsv"
+
+track_catalogue = None
+if os.path.isfile(CATALOGUE_FILE):
+    try:
+        track_catalogue = TrackCatalogue(CATALOGUE_FILE)
+        print("Loaded {}".format(track_catalogue))
+    except TrackCatalogue.Exceptions.InvalidCatalogueException:
+        traceback.print_exc()
+        print("Cannot parse {}, aborting.".format(CATALOGUE_FILE))
+        sys.exit(1)
+
+
+"""
+Resolved track mappings, loaded at startup and written by /export_mappings
+"""
+MAPPINGS_FILE = "mappings.json.gz"
+
+track_mappings = TrackMappingCache()
+if os.path.isfile(MAPPINGS_FILE):
+    with open(MAPPINGS_FILE, "rb") as mappings_file:
+        try:
+            track_mappings.load(mappings_file)
+            print("Loaded {}".format(track_mappings))
+        except ValueError:
+            traceback.print_exc()
+            print("Cannot parse {}, starting with no mappings.".format(MAPPINGS_FILE))
+
+
+"""
+YouTube playlist ids used by /prewarm_mappings when none are given, one per line
+"""
+PREWARM_PLAYLISTS_FILE = "prewarm_playlists.txt"
+
+
 """
 Scopes to be used for OAuth
 """
@@ -56,6 +105,37 @@ SCOPES = {
 }
 
 
+"""
+Time budgets of routes in seconds, other routes get DEFAULT_ROUTE_BUDGET
+"""
+ROUTE_BUDGETS = {
+    "read_youtube_playlist": 300,
+    "select_export_playlist": 120
+}
+DEFAULT_ROUTE_BUDGET = 30
+
+
+"""
+Scheduling priorities of routes' upstream calls by endpoint and method, other
+routes are interactive
+"""
+ROUTE_PRIORITIES = {
+    ("read_youtube_playlist", "GET"): priorities.TRANSLATION,
+    ("select_export_playlist", "POST"): priorities.BULK
+}
+
+# Shared by all sessions, configured by an optional "scheduler" entry in
+# client_info.json, e.g. {"concurrency": 8, "rate": 10}
+upstream_scheduler = UpstreamScheduler(**CLIENT_INFO.get("scheduler", {}))
+
+
+"""
+Opt-in request profiling, configured by an optional "profiling" entry in
+client_info.json, e.g. {"enabled": true, "sample_rate": 0.01}
+"""
+request_profiler = profiling.RequestProfiler(**CLIENT_INFO.get("profiling", {}))
+
+
 """
 App configurations
 """
@@ -75,6 +155,22 @@ Handy functions
 class SessionNotCreatedException(Exception):
     """Session has not been created"""
 
+# Guards storing translation results against superseded translations
+translation_lock = threading.Lock()
+
+# Default and maximum number of items in a page of JSON results
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Maximum number of YouTube playlists fetched concurrently by one request
+PLAYLIST_FETCH_THREADS = 4
+
+# Maximum number of YouTube playlists merged into one translation
+MAX_PLAYLISTS = 10
+
+# Addresses allowed to use maintenance routes
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+
 def get_session_id():
     """Get session id"""
     try:
@@ -84,15 +180,114 @@ def get_session_id():
 
 def get_session_data(*namespaces):
     """Get session data wrapper"""
-    return session_data.get(get_session_id(), *namespaces)
+    with profiling.span("session", "get"):
+        return session_data.get(get_session_id(), *namespaces)
 
 def set_session_data(*namespaces, **props):
     """Set session data wrapper"""
-    return session_data.set(get_session_id(), *namespaces, **props)
+    with profiling.span("session", "set"):
+        return session_data.set(get_session_id(), *namespaces, **props)
 
 def remove_session_data(*namespaces):
     """Remove session data wrapper"""
-    return session_data.remove(get_session_id(), *namespaces)
+    with profiling.span("session", "remove"):
+        return session_data.remove(get_session_id(), *namespaces)
+
+def get_deadline():
+    """Deadline of the current request"""
+    return flask.g.deadline
+
+def connection_probe():
+    """
+    Probe telling whether the client of the current request has disconnected,
+    None if the connection cannot be inspected
+    """
+    environ = flask.request.environ
+    connection = environ.get("werkzeug.socket")
+    if connection is None:
+        try:
+            # Duplicate the socket behind wsgi.input, closed when the request ends
+            connection = socket.fromfd(environ["wsgi.input"].fileno(),
+                                       socket.AF_INET, socket.SOCK_STREAM)
+            flask.g.connection = connection
+        except (KeyError, AttributeError, ValueError, EnvironmentError):
+            return None
+
+    def probe():
+        """Closed connections are readable with nothing left to read"""
+        try:
+            readable, _, _ = select.select([connection], [], [], 0)
+            return bool(readable) and connection.recv(1, socket.MSG_PEEK) == b""
+        except (select.error, socket.error, ValueError):
+            return True
+
+    return probe
+
+def render_template(template_name, **context):
+    """Render template wrapper"""
+    with profiling.span("render", template_name):
+        return flask.render_template(template_name, **context)
+
+def paginate(items):
+    """
+    JSON response with one page of items.
+
+    The page starts at the "cursor" query argument and holds at most "limit"
+    items. "next_cursor" is null on the last page.
+    """
+    try:
+        cursor = int(flask.request.args.get("cursor", 0))
+        limit = min(int(flask.request.args.get("limit", PAGE_SIZE)), MAX_PAGE_SIZE)
+        if cursor < 0 or limit < 1:
+            raise ValueError()
+    except ValueError:
+        return "Invalid cursor or limit", status.HTTP_400_BAD_REQUEST
+
+    next_cursor = cursor + limit
+    body = json.dumps({
+        "items": items[cursor:next_cursor],
+        "next_cursor": str(next_cursor) if next_cursor < len(items) else None,
+        "total": len(items)
+    }, separators=(",", ":"))
+
+    return flask.Response(body, mimetype="application/json")
+
+def find_track(spotify_session, query, deadline=None):
+    """Find a Spotify track, trying the local catalogue before searching"""
+    if track_catalogue is not None:
+        track = track_catalogue.lookup(query)
+        if track is not None:
+            return track
+
+    track = track_mappings.get(query)
+    if track is None:
+        track = spotify_session.search_track(query, deadline)
+        track_mappings.set(query, track)
+
+    return track
+
+def translate_playlists(spotify_session, youtube_session, playlist_ids, deadline=None):
+    """Translate YouTube playlists, looking up tracks with find_track"""
+    return playlist_translation.translate_playlists(
+        youtube_session, playlist_ids,
+        lambda query, deadline: find_track(spotify_session, query, deadline),
+        deadline, PLAYLIST_FETCH_THREADS)
+
+def prewarm_mappings(spotify_session, youtube_session, playlist_ids):
+    """Revalidate cached mappings and resolve playlists ahead of traffic"""
+    deadline = Deadline(priority=priorities.BULK)
+    try:
+        print("Prewarming: dropped {} stale mappings".format(
+            track_mappings.revalidate(spotify_session, deadline)))
+
+        for playlist_id in playlist_ids:
+            translate_playlists(spotify_session, youtube_session, [playlist_id], deadline)
+            print("Prewarming: resolved playlist {}".format(playlist_id))
+
+    except OAuth2Session.Exceptions.RequestFailedException:
+        traceback.print_exc()
+
+    print("Prewarming finished, {}".format(track_mappings))
 
 
 """
@@ -106,6 +301,8 @@ def handle_general_exceptions(f):
     - SessionNamespaceNotFoundException
     - OAuth2Session.Exceptions.NotAuthorizedException
     - OAuth2Session.Exceptions.AccessTokenRequestFailedException
+    - Deadline.Exceptions.DeadlineExceededException
+    - Deadline.Exceptions.CancelledException
     """
     def wrapper(*args, **kargs):
         """Wrapper"""
@@ -124,6 +321,12 @@ def handle_general_exceptions(f):
         except OAuth2Session.Exceptions.AccessTokenRequestFailedException:
             return "Request access token failed", status.HTTP_400_BAD_REQUEST
 
+        except Deadline.Exceptions.DeadlineExceededException:
+            return "Request timed out", status.HTTP_504_GATEWAY_TIMEOUT
+
+        except Deadline.Exceptions.CancelledException:
+            return "Request cancelled", status.HTTP_409_CONFLICT
+
     wrapper.__name__ = f.__name__
     return wrapper
 
@@ -179,10 +382,10 @@ def home():
         # Get authenticated services
         auths = {k: str(v) for (k, v) in get_session_data("oauth_sessions").iteritems()}
 
-        return flask.render_template("status.html", session_id=session_id, auths=auths)
+        return render_template("status.html", session_id=session_id, auths=auths)
 
     except SessionNotCreatedException:
-        return flask.render_template("guest.html")
+        return render_template("guest.html")
 
 
 @app.route("/auth_spotify")
@@ -194,7 +397,9 @@ def auth_spotify():
     spotify_session = SpotifyClient(
         flask,
         CLIENT_INFO["spotify"]["client_id"], CLIENT_INFO["spotify"]["client_secret"],
-        "http://localhost:5000/spotify-authorization-callback")
+        "http://localhost:5000/spotify-authorization-callback",
+        scheduler=upstream_scheduler,
+        **CLIENT_INFO["spotify"].get("endpoints", {}))
 
     set_session_data("oauth_sessions", "spotify", data=spotify_session)
 
@@ -232,7 +437,9 @@ def auth_youtube():
     youtube_session = YouTubeClient(
         flask,
         CLIENT_INFO["youtube"]["client_id"], CLIENT_INFO["youtube"]["client_secret"],
-        "http://localhost:5000/youtube-authorization-callback")
+        "http://localhost:5000/youtube-authorization-callback",
+        scheduler=upstream_scheduler,
+        **CLIENT_INFO["youtube"].get("endpoints", {}))
 
     set_session_data("oauth_sessions", "youtube", data=youtube_session)
 
@@ -277,7 +484,7 @@ def request_token():
         session = get_session_data("oauth_sessions", service_name)
 
         # Manually request new token
-        session.request_new_token()
+        session.request_new_token(get_deadline())
 
         # Return to homepage
         return flask.redirect(flask.url_for("home"))
@@ -289,38 +496,65 @@ def request_token():
 @app.route(("/read_youtube_playlist"))
 @handle_general_exceptions
 def read_youtube_playlist():
-    """Route for translating videos in YouTube playlist into tracks in Spotify"""
+    """
+    Route for translating videos in YouTube playlists into tracks in Spotify.
+    Accepts multiple (or comma separated) youtube_playlist_id arguments,
+    which are merged into one translation.
+    """
     try:
-        playlist_id = flask.request.args.get("youtube_playlist_id")
-        if playlist_id is None:
+        playlist_ids = playlist_translation.unique([
+            playlist_id
+            for argument in flask.request.args.getlist("youtube_playlist_id")
+            for playlist_id in argument.split(",") if playlist_id
+        ])
+        if not playlist_ids:
             return "Invalid request", status.HTTP_400_BAD_REQUEST
+        if len(playlist_ids) > MAX_PLAYLISTS:
+            return "Too many playlists", status.HTTP_400_BAD_REQUEST
 
         spotify_session = get_session_data("oauth_sessions", "spotify")
         youtube_session = get_session_data("oauth_sessions", "youtube")
 
-        # Fetch playlist item names
-        playlist_items = youtube_session.get_playlist_items(playlist_id)
-        playlist_item_names = [item["snippet"]["title"] for item in playlist_items["items"]]
+        # A new translation supersedes the previous one of this session
+        deadline = get_deadline()
+        try:
+            get_session_data("translation_deadline").cancel()
+        except SessionDataContainer.Exceptions.NamespaceNotFoundException:
+            pass
+        set_session_data("translation_deadline", data=deadline)
 
-        # Look for Spotify mappings
-        spotify_mappings = [
-            spotify_session.search_track(YouTubeClient.process_youtube_name(youtube_name))
-            for youtube_name in playlist_item_names
-        ]
+        items, videos = translate_playlists(spotify_session, youtube_session,
+                                            playlist_ids, deadline)
 
-        # Organize result
-        items = [{"youtube": youtube_names, "spotify": spotify_mapping} for
-                 (youtube_names, spotify_mapping) in zip(playlist_item_names, spotify_mappings)]
+        # Only the latest translation of the session may store its result, an
+        # older one may finish after it when the newer one resolved from cache
+        with translation_lock:
+            if get_session_data("translation_deadline") is not deadline:
+                raise Deadline.Exceptions.CancelledException()
 
-        set_session_data("ongoing_translation", "mappings", data=items)
+            set_session_data("ongoing_translation", "mappings", data=items)
 
-        return flask.render_template("youtube_playlist_display.html",
-                                     youtube_playlist_id=playlist_id, items=items)
+        # Mappings are loaded page by page from /ongoing_translation/mappings
+        return render_template("youtube_playlist_display.html",
+                               youtube_playlist_ids=playlist_ids,
+                               total=len(items), videos=videos)
 
     except OAuth2Session.Exceptions.RequestFailedException:
         return "Request failed", status.HTTP_400_BAD_REQUEST
 
 
+@app.route("/cancel_translation", methods=["POST"])
+@handle_general_exceptions
+def cancel_translation():
+    """Cancel the translation running for this session"""
+    try:
+        get_session_data("translation_deadline").cancel()
+    except SessionDataContainer.Exceptions.NamespaceNotFoundException:
+        pass
+
+    return flask.redirect(flask.url_for("home"))
+
+
 @app.route("/select_export_playlist", methods=["GET", "POST"])
 @handle_general_exceptions
 def select_export_playlist():
@@ -352,7 +586,8 @@ def select_export_playlist():
                 return "Invalid playlist id", status.HTTP_400_BAD_REQUEST
 
             # Add tracks to playlist
-            spotify_session.add_tracks_to_playlist(profile["id"], playlist_id, track_uris)
+            spotify_session.add_tracks_to_playlist(profile["id"], playlist_id, track_uris,
+                                                   get_deadline())
 
             # Remove ongoing data
             remove_session_data("ongoing_translation")
@@ -364,8 +599,8 @@ def select_export_playlist():
             spotify_session = get_session_data("oauth_sessions", "spotify")
 
             # Get user profile and playlists
-            profile = spotify_session.get_user_profile()
-            playlists = spotify_session.get_user_playlists()
+            profile = spotify_session.get_user_profile(get_deadline())
+            playlists = spotify_session.get_user_playlists(get_deadline())
 
             # Clean data
             profile = {
@@ -383,9 +618,9 @@ def select_export_playlist():
             set_session_data("ongoing_translation", "profile", data=profile)
             set_session_data("ongoing_translation", "playlists", data=playlists)
 
-            # Render page
-            return flask.render_template("select_spotify_playlist.html",
-                                         profile=profile, playlists=playlists)
+            # Render page, playlists are loaded from /ongoing_translation/playlists
+            return render_template("select_spotify_playlist.html",
+                                   profile=profile, total=len(playlists))
 
     except OAuth2Session.Exceptions.RequestFailedException:
         return "Request failed", status.HTTP_400_BAD_REQUEST
@@ -394,6 +629,93 @@ def select_export_playlist():
         return "Failed to add tracks to playlist", status.HTTP_400_BAD_REQUEST
 
 
+@app.route("/ongoing_translation/mappings")
+@handle_general_exceptions
+def ongoing_translation_mappings():
+    """Page through mappings of the ongoing translation"""
+    return paginate(get_session_data("ongoing_translation", "mappings"))
+
+
+@app.route("/ongoing_translation/playlists")
+@handle_general_exceptions
+def ongoing_translation_playlists():
+    """Page through playlists the ongoing translation can be exported to"""
+    return paginate(get_session_data("ongoing_translation", "playlists"))
+
+
+@app.route("/export_mappings")
+def export_mappings():
+    """Save resolved mappings to MAPPINGS_FILE and download them"""
+    if flask.request.remote_addr not in LOCAL_ADDRESSES:
+        return "Forbidden", status.HTTP_403_FORBIDDEN
+
+    # Write next to MAPPINGS_FILE and rename, so that it is never left half written
+    mappings_dir = os.path.dirname(os.path.abspath(MAPPINGS_FILE))
+    with tempfile.NamedTemporaryFile(dir=mappings_dir, suffix=".tmp", delete=False) as mappings_file:
+        try:
+            track_mappings.dump(mappings_file)
+        except Exception:
+            os.remove(mappings_file.name)
+            raise
+    os.rename(mappings_file.name, MAPPINGS_FILE)
+
+    return flask.send_file(os.path.abspath(MAPPINGS_FILE), as_attachment=True)
+
+
+@app.route("/import_mappings", methods=["POST"])
+def import_mappings():
+    """Load mappings from an uploaded dump"""
+    if flask.request.remote_addr not in LOCAL_ADDRESSES:
+        return "Forbidden", status.HTTP_403_FORBIDDEN
+
+    try:
+        count = track_mappings.load(flask.request.files["mappings"])
+        return "Imported {} mappings.".format(count)
+
+    except KeyError:
+        return "Invalid request", status.HTTP_400_BAD_REQUEST
+
+    except ValueError:
+        return "Invalid mappings file", status.HTTP_400_BAD_REQUEST
+
+
+@app.route("/prewarm_mappings", methods=["POST"])
+@handle_general_exceptions
+def prewarm():
+    """Resolve playlists in the background using the current session's services"""
+    if flask.request.remote_addr not in LOCAL_ADDRESSES:
+        return "Forbidden", status.HTTP_403_FORBIDDEN
+
+    playlist_ids = flask.request.form.get("youtube_playlist_ids", "").split()
+    if not playlist_ids and os.path.isfile(PREWARM_PLAYLISTS_FILE):
+        with open(PREWARM_PLAYLISTS_FILE) as playlists_file:
+            playlist_ids = playlists_file.read().split()
+
+    spotify_session = get_session_data("oauth_sessions", "spotify")
+    youtube_session = get_session_data("oauth_sessions", "youtube")
+
+    # Make sure both services have tokens before leaving the request
+    spotify_session.get_token(get_deadline())
+    youtube_session.get_token(get_deadline())
+
+    worker = threading.Thread(target=prewarm_mappings,
+                              args=(spotify_session, youtube_session, playlist_ids))
+    worker.daemon = True
+    worker.start()
+
+    return "Prewarming {} playlists.".format(len(playlist_ids)), status.HTTP_202_ACCEPTED
+
+
+@app.route("/upstream_scheduler")
+def upstream_scheduler_stats():
+    """Queue depth and wait times of upstream requests per priority"""
+    if flask.request.remote_addr not in LOCAL_ADDRESSES:
+        return "Forbidden", status.HTTP_403_FORBIDDEN
+
+    return flask.Response(json.dumps(upstream_scheduler.stats(), indent=4),
+                          mimetype="application/json")
+
+
 @app.route("/test")
 @handle_general_exceptions
 def test():
@@ -411,6 +733,49 @@ def test():
 """
 Hooks
 """
+@app.before_request
+def create_deadline():
+    """Give every request a time budget, cancelled if the client disconnects"""
+    flask.g.deadline = Deadline(
+        ROUTE_BUDGETS.get(flask.request.endpoint, DEFAULT_ROUTE_BUDGET),
+        probe=connection_probe(),
+        priority=ROUTE_PRIORITIES.get((flask.request.endpoint, flask.request.method),
+                                      priorities.INTERACTIVE))
+
+
+@app.teardown_request
+def release_deadline(_):
+    """Stop probing the connection once the request is over"""
+    deadline = getattr(flask.g, "deadline", None)
+    if deadline is not None:
+        deadline.probe = None
+
+    connection = getattr(flask.g, "connection", None)
+    if connection is not None:
+        connection.close()
+
+
+@app.before_request
+def start_profiling():
+    """Start profiling sampled requests"""
+    if request_profiler.should_profile(flask.request.headers,
+                                       flask.request.remote_addr in LOCAL_ADDRESSES):
+        flask.g.profile = request_profiler.start()
+
+
+@app.teardown_request
+def stop_profiling(_):
+    """Write results of profiled requests"""
+    profile = getattr(flask.g, "profile", None)
+    if profile is not None:
+        try:
+            request_profiler.stop(profile, flask.request.endpoint or "unknown")
+        except EnvironmentError:
+            # Profiling is optional, never fail the request because of it
+            traceback.print_exc()
+            print("Cannot write profile into {}.".format(request_profiler.output_dir))
+
+
 @app.after_request
 def logging(response):
     """Simple loggin of session data"""
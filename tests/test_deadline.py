@@ -0,0 +1,69 @@
+"""Testing deadline module"""
+import time
+
+import pytest
+
+# pylint: skip-file
+
+def test_no_budget():
+    """Testing deadlines without budget never run out"""
+    from apis.deadline import Deadline, timeout
+
+    deadline = Deadline()
+    deadline.check()
+    assert deadline.timeout() is None
+    assert timeout(None) is None
+
+def test_budget():
+    """Testing budget runs out"""
+    from apis.deadline import Deadline
+
+    deadline = Deadline(0.05)
+    assert 0 < deadline.timeout() <= 0.05
+
+    time.sleep(0.06)
+    with pytest.raises(Deadline.Exceptions.DeadlineExceededException):
+        deadline.check()
+
+def test_cancel():
+    """Testing cancellation, directly or through a probe"""
+    from apis.deadline import Deadline
+
+    deadline = Deadline(10)
+    deadline.cancel()
+    with pytest.raises(Deadline.Exceptions.CancelledException):
+        deadline.check()
+
+    disconnected = []
+    deadline = Deadline(10, probe=lambda: bool(disconnected))
+    deadline.check()
+    disconnected.append(True)
+    with pytest.raises(Deadline.Exceptions.CancelledException):
+        deadline.timeout()
+
+def test_sleep():
+    """Testing sleeps longer than the budget fail immediately"""
+    from apis.deadline import Deadline
+
+    deadline = Deadline(0.05)
+    started = time.time()
+    with pytest.raises(Deadline.Exceptions.DeadlineExceededException):
+        deadline.sleep(10)
+    assert time.time() - started < 0.05
+
+def test_request_timeout():
+    """Testing requests timing out under a deadline raise DeadlineExceededException"""
+    import requests
+    from apis.oauth2 import OAuth2Session
+    from apis.deadline import Deadline
+
+    def send_request(method, timeout=None):
+        assert 0 < timeout <= 10
+        raise requests.exceptions.ReadTimeout()
+
+    session = OAuth2Session(
+        None, "TestingService", "client_id", "client_secret",
+        "http://authorize.url", "http://authorize.callback.url", "http://request.token.url")
+
+    with pytest.raises(Deadline.Exceptions.DeadlineExceededException):
+        session.send(Deadline(10), send_request, "http://upstream")
@@ -0,0 +1,71 @@
+"""Testing playlist translation module"""
+import threading
+
+# pylint: skip-file
+
+def playlist(*video_ids):
+    return {"items": [{
+        "snippet": {
+            "title": u"Artist - Song {}".format(video_id),
+            "resourceId": {"videoId": video_id}
+        }
+    } for video_id in video_ids]}
+
+class FakeYouTubeSession(object):
+    def __init__(self, playlists):
+        self.playlists = playlists
+        self.lock = threading.Lock()
+        self.requests = []
+
+    def get_token(self, deadline=None):
+        pass
+
+    def get_playlist_items(self, playlist_id, deadline=None):
+        with self.lock:
+            self.requests.append(playlist_id)
+        return self.playlists[playlist_id]
+
+def test_unique():
+    """Testing repeated playlist ids are dropped in order"""
+    from apis.playlist_translation import unique
+
+    assert unique([u"b", u"a", u"b", u"c", u"a"]) == [u"b", u"a", u"c"]
+
+def test_translate_merges():
+    """Testing playlists are fetched once and searches scale with unique videos"""
+    from apis.playlist_translation import translate_playlists
+
+    youtube_session = FakeYouTubeSession({
+        u"a": playlist(u"1", u"2", u"3"),
+        u"b": playlist(u"3", u"4", u"1")
+    })
+    searches = []
+
+    def find_track(query, deadline):
+        searches.append(query)
+        return {"name": query, "uri": None}
+
+    items, videos = translate_playlists(youtube_session, [u"a", u"b", u"a"], find_track)
+
+    assert sorted(youtube_session.requests) == [u"a", u"b"]
+    assert videos == 4
+    assert searches == [u"Artist - Song {}".format(i) for i in (1, 2, 3, 4)]
+    assert [item["youtube"] for item in items] == searches
+
+def test_translate_deadline():
+    """Testing mappings found before the deadline runs out are kept"""
+    from apis.deadline import Deadline
+    from apis.playlist_translation import translate_playlists
+
+    youtube_session = FakeYouTubeSession({u"a": playlist(u"1", u"2", u"3")})
+
+    def find_track(query, deadline):
+        if query.endswith(u"3"):
+            raise Deadline.Exceptions.DeadlineExceededException()
+        return {"name": query, "uri": None}
+
+    items, videos = translate_playlists(youtube_session, [u"a"], find_track)
+
+    assert youtube_session.requests == [u"a"]
+    assert videos == 3
+    assert len(items) == 2
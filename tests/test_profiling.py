@@ -0,0 +1,81 @@
+"""Testing profiling module"""
+import json
+import os
+
+# pylint: skip-file
+
+def test_disabled():
+    """Testing spans are no-ops and nothing is sampled when disabled"""
+    from apis import profiling
+
+    profiler = profiling.RequestProfiler(sample_rate=1.)
+    assert not profiler.should_profile({"X-Profile": "1"}, trusted=True)
+
+    with profiling.span("upstream"):
+        pass
+    assert getattr(profiling.current, "recorder", None) is None
+
+def test_should_profile():
+    """Testing sampling and header trigger"""
+    from apis import profiling
+
+    assert profiling.RequestProfiler(enabled=True, sample_rate=1.).should_profile({})
+    assert not profiling.RequestProfiler(enabled=True).should_profile({})
+    assert profiling.RequestProfiler(enabled=True).should_profile({"X-Profile": "1"}, trusted=True)
+    assert not profiling.RequestProfiler(enabled=True).should_profile({"X-Profile": "1"})
+
+def test_profile(tmpdir):
+    """Testing profile and span breakdown are written"""
+    from apis import profiling
+
+    profiler = profiling.RequestProfiler(enabled=True, output_dir=str(tmpdir.join("profiles")))
+    profile = profiler.start()
+
+    with profiling.span("upstream", "http://upstream"):
+        pass
+    with profiling.span("upstream", "http://upstream"):
+        pass
+    with profiling.span("render", "template.html"):
+        pass
+
+    file_name = profiler.stop(profile, "route")
+
+    assert os.path.isfile(file_name + ".prof")
+    with open(file_name + ".json") as breakdown:
+        breakdown = json.load(breakdown)
+
+    assert breakdown["name"] == "route"
+    assert breakdown["categories"]["upstream"]["count"] == 2
+    assert breakdown["categories"]["render"]["count"] == 1
+    assert len(breakdown["spans"]) == 3
+    assert getattr(profiling.current, "recorder", None) is None
+
+def test_overlapping_spans():
+    """Testing spans from propagated threads are not counted twice as local time"""
+    import threading
+    import time
+    from apis import profiling
+
+    profiler = profiling.RequestProfiler(enabled=True)
+    profile = profiler.start()
+    recorder = profiling.current.recorder
+
+    def upstream():
+        with profiling.span("upstream"):
+            time.sleep(0.1)
+
+    threads = [threading.Thread(target=profiling.propagate(upstream)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    breakdown = recorder.breakdown()
+    profile.disable()
+    del profiling.current.recorder
+
+    upstream = breakdown["categories"]["upstream"]
+    assert upstream["count"] == 4
+    assert upstream["time"] > 0.35
+    assert upstream["wall"] < 0.2
+    assert 0 <= breakdown["local"] < breakdown["total"]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Testing track catalogue module"""
+import pytest
+
+# pylint: skip-file
+
+@pytest.fixture(scope="module")
+def catalogue(tmpdir_factory):
+    from apis.track_catalogue import TrackCatalogue
+
+    path = tmpdir_factory.mktemp("catalogue").join("catalogue.tsv")
+    path.write_binary(u"\n".join([
+        u"spotify:track:1\tShape of You\tEd Sheeran\t233712",
+        u"spotify:track:2\tPerfect\tEd Sheeran\t263400",
+        u"spotify:track:3\tDespacito\tLuis Fonsi; Daddy Yankee\t228826",
+        u"spotify:track:4\tJosé\tAlgún Artista\t200000",
+    ]).encode("utf-8") + b"\n")
+
+    return TrackCatalogue(str(path))
+
+def test_index(catalogue):
+    """Testing every record gets indexed"""
+    assert len(catalogue) == 4
+    assert len(catalogue.index["sheeran"]) == 2
+
+def test_lookup(catalogue):
+    """Testing confident matches return search_track style results"""
+    assert catalogue.lookup(u"Ed Sheeran - Shape of You") == {
+        "name": u"Shape of You",
+        "uri": u"spotify:track:1"
+    }
+    assert catalogue.lookup(u"Luis Fonsi - Despacito ft. Daddy Yankee")["uri"] == u"spotify:track:3"
+    assert catalogue.lookup(u"algún artista josé")["uri"] == u"spotify:track:4"
+
+def test_lookup_miss(catalogue):
+    """Testing weak or absent matches fall through"""
+    assert catalogue.lookup(u"Ed Sheeran live at Wembley full concert 2017") is None
+    assert catalogue.lookup(u"Something else entirely") is None
+    assert catalogue.lookup(u"") is None
+
+def test_lookup_same_artist(catalogue):
+    """Testing other songs of a catalogued artist are not matched"""
+    assert catalogue.lookup(u"Ed Sheeran - Happier") is None
+    assert catalogue.lookup(u"Daddy Yankee - Gasolina") is None
+
+def test_lookup_other_artist(catalogue):
+    """Testing songs of the same name by other artists are not matched"""
+    assert catalogue.lookup(u"Someone Else - Perfect") is None
+
+def test_invalid_catalogue(tmpdir):
+    """Testing malformed records are rejected"""
+    from apis.track_catalogue import TrackCatalogue
+
+    path = tmpdir.join("invalid.tsv")
+    for record in (b"spotify:track:1\tMissing fields\n",
+                   b"spotify:track:1\tNot \xff UTF-8\tArtist\t200000\n"):
+        path.write_binary(record)
+
+        with pytest.raises(TrackCatalogue.Exceptions.InvalidCatalogueException):
+            TrackCatalogue(str(path))
@@ -0,0 +1,97 @@
+"""Testing track mapping cache module"""
+from io import BytesIO
+import gzip
+
+import pytest
+
+# pylint: skip-file
+
+URI_1 = u"spotify:track:4iV5W9uYEdYUVa79Axb7Rh"
+URI_2 = u"spotify:track:1301WleyT98MSxVHPZCA6M"
+
+@pytest.fixture
+def cache():
+    from apis.track_mapping_cache import TrackMappingCache
+
+    cache = TrackMappingCache()
+    cache.set(u"Ed Sheeran - Shape of You", {"name": u"Shape of You", "uri": URI_1})
+    cache.set(u"Gone Track", {"name": u"Gone", "uri": URI_2})
+    cache.set(u"No Match", {"name": None, "uri": None})
+    return cache
+
+class FakeSpotifySession(object):
+    def __init__(self, known_ids):
+        self.known_ids = known_ids
+        self.requests = []
+
+    def get_several_tracks(self, track_ids, deadline=None):
+        self.requests.append(track_ids)
+        return [{"id": i} if i in self.known_ids else None for i in track_ids]
+
+def test_get(cache):
+    """Testing queries are normalized"""
+    assert cache.get(u"  ed sheeran -  SHAPE of you")["uri"] == URI_1
+    assert cache.get(u"No Match") is None
+    assert cache.get(u"Unknown") is None
+
+def test_dump_load(cache):
+    """Testing mappings survive a dump and load"""
+    from apis.track_mapping_cache import TrackMappingCache
+
+    dump = BytesIO()
+    assert cache.dump(dump) == 2
+
+    loaded = TrackMappingCache()
+    assert loaded.load(BytesIO(dump.getvalue())) == 2
+    assert loaded.mappings == cache.mappings
+
+def test_load_invalid():
+    """Testing invalid dumps are rejected"""
+    from apis.track_mapping_cache import TrackMappingCache
+
+    with pytest.raises(ValueError):
+        TrackMappingCache().load(BytesIO(b"not gzip"))
+
+    for rows in (b'{"a":1}', b'[[1,"a","b"]]', b'[["a","b"]]', b'["abc"]', b'[["a",1,"b"]]',
+                 b'[["q","n","not a uri"]]', b'[["q","n","spotify:track:1"]]'):
+        dump = BytesIO()
+        with gzip.GzipFile(fileobj=dump, mode="wb") as out:
+            out.write(rows)
+
+        with pytest.raises(ValueError):
+            TrackMappingCache().load(BytesIO(dump.getvalue()))
+
+def test_max_size():
+    """Testing the least recently set mappings are dropped first"""
+    from apis.track_mapping_cache import TrackMappingCache
+
+    cache = TrackMappingCache(max_size=2)
+    cache.set(u"a", {"name": u"a", "uri": URI_1})
+    cache.set(u"b", {"name": u"b", "uri": URI_2})
+    cache.set(u"a", {"name": u"a", "uri": URI_1})
+    cache.set(u"c", {"name": u"c", "uri": URI_2})
+
+    assert len(cache) == 2
+    assert cache.get(u"b") is None
+    assert cache.get(u"a") is not None
+
+def test_load_skips_misses():
+    """Testing misses in older dumps are not loaded"""
+    from apis.track_mapping_cache import TrackMappingCache
+
+    dump = BytesIO()
+    with gzip.GzipFile(fileobj=dump, mode="wb") as out:
+        out.write(u'[["a","b","{}"],["c",null,null]]'.format(URI_1).encode("ascii"))
+
+    cache = TrackMappingCache()
+    assert cache.load(BytesIO(dump.getvalue())) == 1
+    assert cache.get(u"c") is None
+
+def test_revalidate(cache):
+    """Testing stale URIs are dropped using batched lookups"""
+    spotify_session = FakeSpotifySession(known_ids=[u"4iV5W9uYEdYUVa79Axb7Rh"])
+
+    assert cache.revalidate(spotify_session) == 1
+    assert spotify_session.requests == [[u"1301WleyT98MSxVHPZCA6M", u"4iV5W9uYEdYUVa79Axb7Rh"]]
+    assert cache.get(u"Gone Track") is None
+    assert cache.get(u"Ed Sheeran - Shape of You") is not None
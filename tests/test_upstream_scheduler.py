@@ -0,0 +1,134 @@
+"""Testing upstream scheduler module"""
+import threading
+import time
+
+import pytest
+
+# pylint: skip-file
+
+def deadline(priority, budget=None):
+    from apis.deadline import Deadline
+    return Deadline(budget, priority=priority)
+
+def test_reserved():
+    """Testing each priority gets its reserved slots"""
+    from apis.upstream_scheduler import UpstreamScheduler, INTERACTIVE, TRANSLATION, BULK
+
+    scheduler = UpstreamScheduler(concurrency=4, shares={INTERACTIVE: .25, TRANSLATION: .25, BULK: .25})
+    assert scheduler.shared == 1
+
+    # Bulk takes its reserved slot and the shared one
+    bulk = [scheduler.slot(deadline(BULK)) for _ in range(2)]
+    for slot in bulk:
+        slot.__enter__()
+
+    # Interactive still gets its reserved slot immediately
+    with scheduler.slot(deadline(INTERACTIVE)):
+        assert scheduler.stats()["priorities"][INTERACTIVE]["running"] == 1
+
+    # Bulk is out of slots
+    with pytest.raises(deadline(BULK).Exceptions.DeadlineExceededException):
+        with scheduler.slot(deadline(BULK, .1)):
+            pass
+    assert scheduler.stats()["priorities"][BULK]["queued"] == 0
+
+    for slot in bulk:
+        slot.__exit__(None, None, None)
+    assert scheduler.stats()["priorities"][BULK]["running"] == 0
+
+def test_shared_priority():
+    """Testing shared slots go to the highest waiting priority"""
+    from apis.upstream_scheduler import UpstreamScheduler, INTERACTIVE, TRANSLATION, BULK
+
+    scheduler = UpstreamScheduler(concurrency=1, shares={INTERACTIVE: 0, TRANSLATION: 0, BULK: 0})
+    order = []
+
+    def request(priority):
+        with scheduler.slot(deadline(priority)):
+            order.append(priority)
+
+    holder = scheduler.slot(deadline(TRANSLATION))
+    holder.__enter__()
+
+    threads = [threading.Thread(target=request, args=(priority,)) for priority in (BULK, INTERACTIVE)]
+    for thread in threads:
+        thread.start()
+        time.sleep(.05)
+
+    holder.__exit__(None, None, None)
+    for thread in threads:
+        thread.join()
+
+    assert order == [INTERACTIVE, BULK]
+    assert scheduler.stats()["priorities"][BULK]["wait_max"] > 0
+
+def test_rate():
+    """Testing priorities are limited to their share of the rate"""
+    from apis.upstream_scheduler import UpstreamScheduler, INTERACTIVE, TRANSLATION, BULK
+
+    scheduler = UpstreamScheduler(concurrency=8, rate=20,
+                                  shares={INTERACTIVE: .5, TRANSLATION: .5, BULK: 0})
+
+    # Burst of one second worth of tokens, then 10 requests per second
+    started = time.time()
+    for _ in range(12):
+        with scheduler.slot(deadline(INTERACTIVE)):
+            pass
+    assert .1 < time.time() - started < .5
+
+def test_rate_outranked():
+    """Testing an outranked priority waits for its own token instead of slipping through"""
+    from apis.upstream_scheduler import UpstreamScheduler, INTERACTIVE, TRANSLATION, BULK, TOKENS
+
+    scheduler = UpstreamScheduler(concurrency=2, rate=2,
+                                  shares={INTERACTIVE: 0, TRANSLATION: 0, BULK: .5})
+
+    # Use up bulk's own token, the shared bucket still holds one
+    with scheduler.slot(deadline(BULK)):
+        pass
+    assert scheduler.tokens[None] >= 1
+
+    # Interactive is waiting for a token
+    scheduler.waiting[INTERACTIVE][TOKENS] = 1
+    with pytest.raises(deadline(BULK).Exceptions.DeadlineExceededException):
+        with scheduler.slot(deadline(BULK, .1)):
+            pass
+
+    assert scheduler.tokens[None] >= 1
+    assert all(stats["running"] == 0 for stats in scheduler.stats()["priorities"].values())
+
+    # Once interactive is served, bulk gets through again
+    scheduler.waiting[INTERACTIVE][TOKENS] = 0
+    with scheduler.slot(deadline(BULK, 1)):
+        assert scheduler.stats()["priorities"][BULK]["running"] == 1
+    assert scheduler.stats()["priorities"][BULK]["running"] == 0
+
+def test_rate_outranked_reserved():
+    """Testing shared tokens go to a higher priority waiting below its reserved concurrency"""
+    from apis.upstream_scheduler import (UpstreamScheduler, INTERACTIVE, TRANSLATION,
+                                         CONCURRENCY, TOKENS)
+
+    scheduler = UpstreamScheduler(concurrency=8, rate=4)
+
+    # Interactive and translation used up their own tokens, the shared bucket holds one
+    scheduler.tokens.update({INTERACTIVE: 0, TRANSLATION: 0, None: 1})
+
+    # Interactive is waiting for a token, not for a slot
+    scheduler.waiting[INTERACTIVE][TOKENS] = 1
+    acquired, blocked, _ = scheduler.try_acquire(TRANSLATION)
+    assert not acquired and blocked == TOKENS
+    assert scheduler.tokens[None] >= 1
+    assert scheduler.running[TRANSLATION] == 0
+
+    # Waiting for a slot does not hold back tokens
+    scheduler.waiting[INTERACTIVE][TOKENS] = 0
+    scheduler.waiting[INTERACTIVE][CONCURRENCY] = 1
+    assert scheduler.try_acquire(TRANSLATION)[0]
+    assert scheduler.tokens[None] < 1
+
+def test_invalid_shares():
+    """Testing shares may not exceed the whole"""
+    from apis.upstream_scheduler import UpstreamScheduler, INTERACTIVE
+
+    with pytest.raises(ValueError):
+        UpstreamScheduler(shares={INTERACTIVE: .9})